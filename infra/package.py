@@ -1,8 +1,7 @@
 import os
-import shutil
 from abc import ABCMeta, abstractmethod
 from typing import Iterable, Iterator, Tuple
-from .util import Namespace
+from .util import Namespace, run
 
 
 class Package(metaclass=ABCMeta):
@@ -155,7 +154,8 @@ class Package(metaclass=ABCMeta):
 
         :param ctx: the configuration context
         """
-        shutil.rmtree(self.path(ctx))
+        # rm is considerably faster than shutil.rmtree on large build trees
+        run(ctx, ['rm', '-rf', self.path(ctx)])
 
     def path(self, ctx: Namespace, *args: Iterable[str]) -> str:
         """
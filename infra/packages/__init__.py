@@ -1,6 +1,7 @@
 from .gnu import Bash, CoreUtils, BinUtils, Make, \
                  M4, AutoConf, AutoMake, LibTool, Netcat
 from .cmake import CMake
+from .ccache import CCache
 from .llvm import LLVM, LLVMBinDist
 from .patchelf import PatchElf
 from .prelink import LibElf, Prelink
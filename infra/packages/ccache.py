@@ -0,0 +1,84 @@
+import os
+import shutil
+from typing import List, Optional
+from ..package import Package
+from ..util import Namespace
+
+
+class CCache(Package):
+    """
+    Wrapper for the system installation of `ccache <https://ccache.dev>`_.
+    Packages that depend on it can pass :func:`compiler_vars` (or
+    :func:`make_vars` for Makefiles that pick their own compiler) to their
+    build system to cache compilation results across rebuilds. If ``ccache``
+    is not installed, nothing is wrapped and the regular compilers are used.
+
+    The cache is stored in ``build/cache/ccache``, and paths are made relative
+    to the project root so that hits are shared between checkouts.
+
+    :identifier: ccache
+    """
+
+    def ident(self):
+        return 'ccache'
+
+    def is_fetched(self, ctx):
+        return True
+
+    def is_built(self, ctx):
+        return True
+
+    def is_installed(self, ctx):
+        return True
+
+    def fetch(self, ctx):
+        pass
+
+    def build(self, ctx):
+        pass
+
+    def install(self, ctx):
+        pass
+
+    def install_env(self, ctx):
+        ctx.runenv.CCACHE_DIR = os.path.join(ctx.paths.cache, 'ccache')
+        ctx.runenv.CCACHE_BASEDIR = ctx.paths.root
+
+    def is_available(self, ctx: Namespace) -> bool:
+        """
+        Returns ``True`` if ``ccache`` is in ``PATH`` or ``ctx.runenv.PATH``.
+
+        :param ctx: the configuration context
+        """
+        if 'PATH' in ctx.runenv:
+            path = Namespace(PATH=ctx.runenv.PATH).join_paths().PATH
+        else:
+            path = os.getenv('PATH')
+        return shutil.which('ccache', path=path) is not None
+
+    def compiler_vars(self, ctx: Namespace, cc: Optional[str] = None,
+                      cxx: Optional[str] = None) -> List[str]:
+        """
+        Get ``CC=ccache <cc>`` and ``CXX=ccache <cxx>`` arguments for
+        ``configure`` or ``make``, or an empty list if ccache is not available.
+
+        :param ctx: the configuration context
+        :param cc: C compiler to wrap, defaults to ``$CC`` or ``gcc``
+        :param cxx: C++ compiler to wrap, defaults to ``$CXX`` or ``g++``
+        """
+        if not self.is_available(ctx):
+            return []
+        cc = cc or os.environ.get('CC', 'gcc')
+        cxx = cxx or os.environ.get('CXX', 'g++')
+        return ['CC=ccache ' + cc, 'CXX=ccache ' + cxx]
+
+    def make_vars(self, ctx: Namespace) -> List[str]:
+        """
+        Get a ``CCACHE=ccache`` argument for ``make``, or an empty list if
+        ccache is not available. Unlike :func:`compiler_vars`, this leaves
+        ``CC``/``CXX`` as chosen by the Makefile, which should prefix compiler
+        invocations with ``$(CCACHE)``.
+
+        :param ctx: the configuration context
+        """
+        return ['CCACHE=ccache'] if self.is_available(ctx) else []
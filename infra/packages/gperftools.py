@@ -1,14 +1,58 @@
 import os
-import shutil
+import re
+import subprocess
+import functools
+from glob import glob
 from typing import List
 from ..package import Package
-from ..util import Namespace, run, apply_patch, download
+from ..util import Namespace, run, apply_patches, download_untar, git_clone, \
+                   make_parallel_args, autoconf_cache_file, find_compiler
 from .gnu import AutoMake
+from .ccache import CCache
+
+
+def _autogen_needed(srcdir: str) -> bool:
+    configure = os.path.join(srcdir, 'configure')
+    if not os.path.exists(configure) or \
+            not os.path.exists(os.path.join(srcdir, 'INSTALL')):
+        return True
+
+    # rerun autoreconf only if any of its inputs changed (e.g., by a patch)
+    inputs = []
+    for pattern in ('*.ac', '**/Makefile.am', 'm4/*.m4'):
+        inputs += glob(os.path.join(srcdir, pattern), recursive=True)
+    mtime = os.path.getmtime(configure)
+    return any(os.path.getmtime(path) > mtime for path in inputs)
+
+
+@functools.lru_cache(maxsize=None)
+def _compiler_tag() -> str:
+    # evaluated once per process, since package identifiers are used as keys;
+    # identifiers have no access to ctx, so this looks up the compiler in the
+    # PATH of the setup process rather than in ctx.runenv
+    cc = find_compiler()
+    if cc is None:
+        return ''
+    proc = subprocess.run([cc, '-dumpversion'], stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, universal_newlines=True)
+    major = proc.stdout.strip().split('.')[0]
+    if not major:
+        return ''
+    # gcc-12 -> gcc12, clang -> clang14
+    name = re.sub(r'[-.\d]+$', '', os.path.basename(cc))
+    return name + major
 
 
 class LibUnwind(Package):
     """
-    :identifier: libunwind-<version>
+    The identifier includes the name and major version of the C compiler that
+    builds the library (``$CC``, or ``gcc`` if unset), so that a compiler
+    upgrade results in a fresh build instead of reusing stale libraries. The
+    compiler is looked up in the ``PATH`` of the setup script, so a compiler
+    that is only added to ``ctx.runenv.PATH`` by another package is not
+    reflected in the identifier.
+
+    :identifier: libunwind-<version>[-<cc><major>]
     :param version: version to download
     """
 
@@ -16,32 +60,37 @@ class LibUnwind(Package):
         self.version = version
 
     def ident(self):
-        return 'libunwind-' + self.version
+        tag = _compiler_tag()
+        return 'libunwind-' + self.version + ('-' + tag if tag else '')
+
+    def dependencies(self):
+        yield CCache()
 
     def is_fetched(self, ctx):
-        return os.path.exists('src')
+        return os.path.lexists('src')
 
     def fetch(self, ctx):
         urlbase = 'http://download.savannah.gnu.org/releases/libunwind/'
-        dirname = self.ident()
-        tarname = dirname + '.tar.gz'
-        download(ctx, urlbase + tarname)
-        run(ctx, ['tar', '-xf', tarname])
-        shutil.move(dirname, 'src')
-        os.remove(tarname)
+        tarname = 'libunwind-%s.tar.gz' % self.version
+        download_untar(ctx, urlbase + tarname, 'src')
 
     def is_built(self, ctx):
-        return os.path.exists('obj/src/.libs/libunwind.so')
+        return os.path.lexists('obj/src/.libs/libunwind.so')
 
     def build(self, ctx):
         os.makedirs('obj', exist_ok=True)
         os.chdir('obj')
         if not os.path.exists('Makefile'):
-            run(ctx, ['../src/configure', '--prefix=' + self.path(ctx, 'install')])
-        run(ctx, 'make -j%d' % ctx.jobs)
+            cmd = ['../src/configure', '--prefix=' + self.path(ctx, 'install'),
+                   '--disable-dependency-tracking',
+                   *CCache().compiler_vars(ctx)]
+            cmd.append('--cache-file=' +
+                       autoconf_cache_file(ctx, self.ident(), cmd))
+            run(ctx, cmd)
+        run(ctx, ['make', *make_parallel_args(ctx)])
 
     def is_installed(self, ctx):
-        return os.path.exists('install/lib/libunwind.so')
+        return os.path.lexists('install/lib/libunwind.so')
 
     def install(self, ctx):
         os.chdir('obj')
@@ -62,41 +111,40 @@ class Gperftools(Package):
     def __init__(self, commit: str, libunwind_version='1.4-rc1', patches: List[str] = []):
         self.commit = commit
         self.libunwind = LibUnwind(libunwind_version)
-        self.patches = patches
+        self.patches = tuple(patches)
 
     def ident(self):
         return 'gperftools-' + self.commit
 
     def dependencies(self):
         yield AutoMake.default()
+        yield CCache()
         yield self.libunwind
 
     def is_fetched(self, ctx):
-        return os.path.exists('src')
+        return os.path.lexists('src')
 
     def fetch(self, ctx):
-        run(ctx, 'git clone https://github.com/gperftools/gperftools.git src')
-        os.chdir('src')
-        run(ctx, ['git', 'checkout', self.commit])
+        git_clone(ctx, 'https://github.com/gperftools/gperftools.git', 'src',
+                  commit=self.commit)
 
     def is_built(self, ctx):
-        return os.path.exists('obj/.libs/libtcmalloc.so')
+        return os.path.lexists('obj/.libs/libtcmalloc.so')
 
     def _apply_patches(self, ctx):
         os.chdir(self.path(ctx, 'src'))
         config_root = os.path.dirname(os.path.abspath(__file__))
-        for path in self.patches:
-            if '/' not in path:
-                path = '%s/%s.patch' % (config_root, path)
-            if apply_patch(ctx, path, 1):
-                ctx.log.warning('applied patch %s to gperftools '
-                                'directory' % path)
+        paths = [path if '/' in path else '%s/%s.patch' % (config_root, path)
+                 for path in self.patches]
+        for path in apply_patches(ctx, paths, 1):
+            ctx.log.warning('applied patch %s to gperftools '
+                            'directory' % path)
         os.chdir(self.path(ctx))
 
     def build(self, ctx):
         self._apply_patches(ctx)
 
-        if not os.path.exists('src/configure') or not os.path.exists('src/INSTALL'):
+        if _autogen_needed('src'):
             os.chdir('src')
             run(ctx, 'autoreconf -vfi')
             self.goto_rootdir(ctx)
@@ -105,16 +153,21 @@ class Gperftools(Package):
         os.chdir('obj')
         if not os.path.exists('Makefile'):
             prefix = self.path(ctx, 'install')
-            run(ctx, [
+            cmd = [
                 '../src/configure',
                 'CPPFLAGS=-I' + self.libunwind.path(ctx, 'install/include'),
                 'LDFLAGS=-L' + self.libunwind.path(ctx, 'install/lib'),
-                '--prefix=' + prefix
-            ])
-        run(ctx, 'make -j%d' % ctx.jobs)
+                '--prefix=' + prefix,
+                '--disable-dependency-tracking',
+                *CCache().compiler_vars(ctx)
+            ]
+            cmd.append('--cache-file=' +
+                       autoconf_cache_file(ctx, self.ident(), cmd))
+            run(ctx, cmd)
+        run(ctx, ['make', *make_parallel_args(ctx)])
 
     def is_installed(self, ctx):
-        return os.path.exists('install/lib/libtcmalloc.so')
+        return os.path.lexists('install/lib/libtcmalloc.so')
 
     def install(self, ctx):
         os.chdir('obj')
@@ -131,10 +184,10 @@ class Gperftools(Package):
         :param ctx: the configuration context
         """
         self.libunwind.configure(ctx)
-        cflags = ['-fno-builtin-' + fn
-                  for fn in ('malloc', 'calloc', 'realloc', 'free')]
-        cflags += ['-I', self.path(ctx, 'install/include/gperftools')]
-        ctx.cflags += cflags
-        ctx.cxxflags += cflags
-        ctx.ldflags += ['-L' + self.path(ctx, 'install/lib'),
-                        '-ltcmalloc', '-lpthread']
+        cflags = ['-fno-builtin-malloc', '-fno-builtin-calloc',
+                  '-fno-builtin-realloc', '-fno-builtin-free',
+                  '-I', self.path(ctx, 'install/include/gperftools')]
+        ctx.cflags.extend(cflags)
+        ctx.cxxflags.extend(cflags)
+        ctx.ldflags.extend(['-L' + self.path(ctx, 'install/lib'),
+                            '-ltcmalloc', '-lpthread'])
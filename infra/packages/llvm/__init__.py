@@ -2,7 +2,8 @@ import os
 import shutil
 from typing import List, Iterable
 from ...package import Package
-from ...util import Namespace, run, apply_patch, download, param_attrs
+from ...util import Namespace, run, apply_patches, download, download_many, \
+                    param_attrs
 from ..gnu import Bash, CoreUtils, BinUtils, Make, AutoMake
 from ..cmake import CMake
 from ..ninja import Ninja
@@ -15,7 +16,7 @@ class LLVM(Package):
     support for ASan).
 
     Supports a number of patches to be passed as arguments, which are
-    :func:`applied <util.apply_patch>` (with ``patch -p1``) before building. A
+    :func:`applied <util.apply_patches>` (with ``-p1``) before building. A
     patch in the list can either be a full path to a patch file, or the name of
     a built-in patch. Available built-in patches are:
 
@@ -60,11 +61,13 @@ class LLVM(Package):
         self.version = version
         self.compiler_rt = compiler_rt
         self.lld = lld
-        self.patches = patches
-        self.build_flags = build_flags
+        # store copies as tuples, so that the (shared) default arguments and
+        # lists passed by the caller are never modified
+        self.patches = tuple(patches)
+        self.build_flags = tuple(build_flags)
 
         if compiler_rt and version == '4.0.0':
-            patches.append('compiler-rt-typefix')
+            self.patches += ('compiler-rt-typefix',)
 
     def ident(self):
         suffix = '-lld' if self.lld else ''
@@ -84,42 +87,40 @@ class LLVM(Package):
         yield Ninja('1.8.2')
 
     def fetch(self, ctx):
-        def get(repo, clonedir):
-            basedir = os.path.dirname(clonedir)
-            if basedir:
-                os.makedirs(basedir, exist_ok=True)
-
-            #url = 'http://llvm.org/svn/llvm-project/%s/trunk' % repo
-            #run(ctx, ['svn', 'co', '-r' + ctx.params.commit, url, clonedir])
-
-            dirname = '%s-%s.src' % (repo, self.version)
-            tarname = dirname + '.tar.xz'
-            major_version = int(self.version.split('.')[0])
-
-            if major_version >= 8:
-                # use github now
-                url_prefix = 'https://github.com/llvm/llvm-project/releases/download'
-                download(ctx, '%s/llvmorg-%s/%s' % (url_prefix, self.version, tarname))
-            else:
-                download(ctx, 'https://releases.llvm.org/%s/%s' % (self.version, tarname))
-
-            run(ctx, ['tar', '-xf', tarname])
-            shutil.move(dirname, clonedir)
-            os.remove(tarname)
-
-        # download and unpack sources
-        get('llvm', 'src')
+        #url = 'http://llvm.org/svn/llvm-project/%s/trunk' % repo
+        #run(ctx, ['svn', 'co', '-r' + ctx.params.commit, url, clonedir])
 
         major_version = int(self.version.split('.')[0])
         if major_version >= 8:
-            get('clang', 'src/tools/clang')
+            # use github now
+            url_prefix = 'https://github.com/llvm/llvm-project/releases/' \
+                         'download/llvmorg-' + self.version
         else:
-            get('cfe', 'src/tools/clang')
+            url_prefix = 'https://releases.llvm.org/' + self.version
 
+        repos = [('llvm', 'src')]
+        if major_version >= 8:
+            repos.append(('clang', 'src/tools/clang'))
+        else:
+            repos.append(('cfe', 'src/tools/clang'))
         if self.compiler_rt:
-            get('compiler-rt', 'src/projects/compiler-rt')
+            repos.append(('compiler-rt', 'src/projects/compiler-rt'))
         if self.lld:
-            get('lld', 'src/projects/lld')
+            repos.append(('lld', 'src/projects/lld'))
+
+        # download all sources at once, then unpack them in order since
+        # subprojects are unpacked into the llvm source tree
+        dirnames = ['%s-%s.src' % (repo, self.version) for repo, _ in repos]
+        tarnames = download_many(ctx, ['%s/%s.tar.xz' % (url_prefix, dirname)
+                                       for dirname in dirnames])
+
+        for (repo, clonedir), dirname, tarname in zip(repos, dirnames, tarnames):
+            basedir = os.path.dirname(clonedir)
+            if basedir:
+                os.makedirs(basedir, exist_ok=True)
+            run(ctx, ['tar', '-xf', tarname])
+            shutil.move(dirname, clonedir)
+            os.remove(tarname)
 
     def build(self, ctx):
         # TODO: verify that any applied patches are in self.patches, error
@@ -130,10 +131,10 @@ class LLVM(Package):
         # with --force-rebuild
         os.chdir('src')
         config_path = os.path.dirname(os.path.abspath(__file__))
-        for path in self.patches:
-            if '/' not in path:
-                path = '%s/%s-%s.patch' % (config_path, path, self.version)
-            apply_patch(ctx, path, 1)
+        paths = [path if '/' in path else
+                 '%s/%s-%s.patch' % (config_path, path, self.version)
+                 for path in self.patches]
+        apply_patches(ctx, paths, 1)
         os.chdir('..')
 
         os.makedirs('obj', exist_ok=True)
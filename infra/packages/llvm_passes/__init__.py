@@ -1,8 +1,9 @@
 import os
 from typing import List
 from ...package import Package
-from ...util import Namespace, FatalError, run
+from ...util import Namespace, FatalError, run, make_parallel_args
 from ..llvm import LLVM
+from ..ccache import CCache
 
 
 class LLVMPasses(Package):
@@ -81,6 +82,7 @@ class LLVMPasses(Package):
     def dependencies(self):
         yield self.llvm
         yield self.llvm.binutils # for ld.gold
+        yield CCache()
         if self.builtin_passes:
             yield self.builtin_passes
 
@@ -90,7 +92,8 @@ class LLVMPasses(Package):
     def build(self, ctx):
         os.makedirs('obj', exist_ok=True)
         os.chdir(self._srcdir(ctx))
-        self._run_make(ctx, '-j%d' % ctx.jobs)
+        # make>=4.0 is a dependency of LLVM
+        self._run_make(ctx, *make_parallel_args(ctx), '--output-sync=target')
 
     def install(self, ctx):
         os.chdir(self._srcdir(ctx))
@@ -103,7 +106,8 @@ class LLVMPasses(Package):
             'PREFIX=' + self.path(ctx, 'install'),
             'USE_BUILTINS=' + str(bool(self.builtin_passes)).lower(),
             'USE_GOLD_PASSES=' + str(bool(self.gold_passes)).lower(),
-            'DEBUG=' + str(self.debug).lower()
+            'DEBUG=' + str(self.debug).lower(),
+            *CCache().make_vars(ctx)
         ], **kwargs)
 
     def is_fetched(self, ctx):
@@ -138,19 +142,19 @@ class LLVMPasses(Package):
         if compiletime:
             libpath = self.path(ctx, 'install/libpasses-opt.so')
             cflags = ['-Xclang', '-load', '-Xclang', libpath]
-            ctx.cflags += cflags
-            ctx.cxxflags += cflags
+            ctx.cflags.extend(cflags)
+            ctx.cxxflags.extend(cflags)
 
         if linktime:
             libpath = self.path(ctx, 'install/libpasses-gold.so')
-            ctx.cflags += ['-flto']
-            ctx.cxxflags += ['-flto']
-            ctx.ldflags += ['-flto']
+            ctx.cflags.append('-flto')
+            ctx.cxxflags.append('-flto')
             if self.gold_passes:
-                ctx.ldflags += ['-Wl,-plugin-opt=-load=' + libpath]
+                ctx.ldflags.extend(['-flto', '-Wl,-plugin-opt=-load=' + libpath])
             else:
-                ctx.ldflags += ['-fuse-ld=lld', '-Wl,-mllvm=-load=' + libpath]
-            ctx.lib_ldflags += ['-flto']
+                ctx.ldflags.extend(['-flto', '-fuse-ld=lld',
+                                    '-Wl,-mllvm=-load=' + libpath])
+            ctx.lib_ldflags.append('-flto')
 
     def runtime_cflags(self, ctx: Namespace) -> List[str]:
         """
@@ -199,13 +203,13 @@ class BuiltinLLVMPasses(LLVMPasses):
         return os.path.join(ctx.paths.infra, 'llvm-passes',
                             self.llvm.version, *subdirs)
 
+    libs = ('libpasses-builtin.a', 'libpasses-gold.so', 'libpasses-opt.so')
+
     def is_built(self, ctx):
-        files = ('libpasses-builtin.a', 'libpasses-gold.so', 'libpasses-opt.so')
-        return all(os.path.exists('obj/' + f) for f in files)
+        return _contains_all('obj', self.libs)
 
     def is_installed(self, ctx):
-        files = ('libpasses-builtin.a', 'libpasses-gold.so', 'libpasses-opt.so')
-        return all(os.path.exists('install/' + f) for f in files)
+        return _contains_all('install', self.libs)
 
     def pkg_config_options(self, ctx):
         yield ('--cxxflags',
@@ -218,3 +222,11 @@ class BuiltinLLVMPasses(LLVMPasses):
 
     def runtime_cflags(self, ctx):
         return ['-I', self._srcdir(ctx, 'include/runtime')]
+
+
+def _contains_all(dirname, filenames):
+    # list the directory once instead of doing a stat per file
+    try:
+        return set(os.listdir(dirname)).issuperset(filenames)
+    except FileNotFoundError:
+        return False
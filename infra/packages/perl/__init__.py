@@ -1,5 +1,4 @@
 import os
-import stat
 import shutil
 from ...package import Package
 from ...util import run, download, apply_patch, FatalError
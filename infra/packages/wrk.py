@@ -1,7 +1,7 @@
 import os
 import shutil
 from ..package import Package
-from ..util import run, download, require_program, param_attrs
+from ..util import run
 
 
 class Wrk(Package):
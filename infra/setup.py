@@ -71,6 +71,7 @@ class Setup:
                                'runlog':       '/project/build/log/commands.txt',
                                'packages':     '/project/build/packages',
                                'targets':      '/project/build/targets',
+                               'cache':        '/project/build/cache',
                                'pool_results': '/project/results'
                            }),
             'runenv':      Namespace({}),
@@ -104,7 +105,8 @@ class Setup:
     :func:`multiprocessing.cpu_count`.
 
     ``ctx.paths`` are absolute paths to be used (readonly) throughout the
-    framework.
+    framework. ``ctx.paths.cache`` is shared by all packages for caches that
+    outlive a single package build directory (e.g., git mirrors).
 
     ``ctx.runenv`` defines environment variables for :func:`util.run`, which is
     a wrapper for :func:`subprocess.run` that does logging and other useful
@@ -221,6 +223,7 @@ class Setup:
         paths.runlog = os.path.join(paths.log, 'commands.txt')
         paths.packages = os.path.join(paths.buildroot, 'packages')
         paths.targets = os.path.join(paths.buildroot, 'targets')
+        paths.cache = os.path.join(paths.buildroot, 'cache')
         paths.pool_results = os.path.join(paths.root, 'results')
 
         self.ctx.runenv = Namespace()
@@ -1,9 +1,8 @@
 import os
-import shutil
 import argparse
 from abc import ABCMeta, abstractmethod
 from typing import List, Dict, Iterable, Iterator, Optional, Any
-from .util import Namespace
+from .util import Namespace, run
 from .instance import Instance
 from .package import Package
 from .parallel import Pool
@@ -76,7 +75,12 @@ class Target(metaclass=ABCMeta):
         return isinstance(other, self.__class__) and other.name == self.name
 
     def __hash__(self):
-        return hash('target-' + self.name)
+        # cache the hash since targets are used as keys during dependency
+        # resolution (the name is fixed per target)
+        h = getattr(self, '_hash', None)
+        if h is None:
+            h = self._hash = hash(('target', self.name))
+        return h
 
     def add_build_args(self, parser: argparse.ArgumentParser):
         """
@@ -239,7 +243,7 @@ class Target(metaclass=ABCMeta):
 
         :param ctx: the configuration context
         """
-        shutil.rmtree(self.path(ctx))
+        run(ctx, ['rm', '-rf', self.path(ctx)])
 
     def binary_paths(self, ctx: Namespace, instance: Instance) -> Iterable[str]:
         """
@@ -256,6 +260,19 @@ class Target(metaclass=ABCMeta):
         raise NotImplementedError(self.__class__.__name__)
 
     def run_hooks_post_build(self, ctx, instance):
+        """
+        Call the post-build hooks in ``ctx.hooks.post_build`` for each binary
+        returned by :func:`binary_paths`.
+
+        Hooks are called serially, in order, with the working directory set to
+        the directory of the binary. They cannot be run in parallel threads:
+        hooks rely on the (process-wide) working directory for relative output
+        paths, hooks for the same binary depend on each other's results, and
+        :func:`util.run` shares a single output buffer in ``ctx``.
+
+        :param ctx: the configuration context
+        :param instance: instance that was built
+        """
         if ctx.hooks.post_build:
             for binary in self.binary_paths(ctx, instance):
                 absbin = os.path.abspath(binary)
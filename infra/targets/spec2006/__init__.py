@@ -8,7 +8,7 @@ from contextlib import redirect_stdout
 from collections import defaultdict
 from typing import List
 from ...commands.report import outfile_path
-from ...util import FatalError, run, apply_patch, qjoin, require_program
+from ...util import FatalError, run, apply_patches, qjoin, require_program
 from ...target import Target
 from ...packages import Bash, Nothp, RusageCounters
 from ...parallel import PrunPool
@@ -244,10 +244,10 @@ class SPEC2006(Target):
     def _apply_patches(self, ctx):
         os.chdir(self._install_path(ctx))
         config_root = os.path.dirname(os.path.abspath(__file__))
-        for path in self.patches:
-            if '/' not in path:
-                path = '%s/%s.patch' % (config_root, path)
-            if apply_patch(ctx, path, 1) and self.source_type == 'installed':
+        paths = [path if '/' in path else '%s/%s.patch' % (config_root, path)
+                 for path in self.patches]
+        for path in apply_patches(ctx, paths, 1):
+            if self.source_type == 'installed':
                 ctx.log.warning('applied patch %s to external SPEC-CPU2006 '
                                 'directory' % path)
 
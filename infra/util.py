@@ -4,19 +4,23 @@ import subprocess
 import shlex
 import io
 import threading
-import select
+import selectors
+import fcntl
 import inspect
 import functools
 import shutil
-import argparse
-import csv
 import re
+import hashlib
+import tempfile
 from collections import OrderedDict
-from typing import Union, List, Dict, Iterable, Optional, Callable, Any
-from urllib.request import urlretrieve
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union, List, Dict, Iterable, Optional, Callable, Any, \
+                   BinaryIO, Mapping
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from email.utils import formatdate, parsedate_to_datetime
 from urllib.parse import urlparse
 from contextlib import redirect_stdout
-from functools import reduce
 
 
 class Namespace(dict):
@@ -25,11 +29,10 @@ class Namespace(dict):
     is the same as ``ns['key']``. Used for the context (see
     :class:`Setup`).
     """
-    def __getattr__(self, key):
-        return self[key]
-
-    def __setattr__(self, key, value):
-        self[key] = value
+    # use the C implementations directly instead of Python wrappers, the
+    # context is accessed all over the place
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
 
     def copy(self) -> 'Namespace':
         """
@@ -38,7 +41,8 @@ class Namespace(dict):
         """
         ns = self.__class__()
         for key, value in self.items():
-            if isinstance(value, (self.__class__, list, dict)):
+            if type(value) not in _immutable_types and \
+                    isinstance(value, (self.__class__, list, dict)):
                 value = value.copy()
             ns[key] = value
         return ns
@@ -51,14 +55,32 @@ class Namespace(dict):
         """
         new = self.__class__()
         for key, value in self.items():
-            if isinstance(value, (tuple, list)):
+            # look up common types directly, isinstance is only needed for
+            # subclasses
+            join = _path_joiners.get(type(value))
+            if join is not None:
+                value = join(value)
+            elif isinstance(value, (tuple, list)):
                 value = ':'.join(value)
             elif isinstance(value, self.__class__):
-                value = value.join_paths()
-            new[key] = str(value)
+                value = str(value.join_paths())
+            else:
+                value = str(value)
+            new[key] = value
         return new
 
 
+_immutable_types = {str, int, float, bool, bytes, type(None)}
+
+_path_joiners = {
+    str: str,
+    int: str,
+    list: ':'.join,
+    tuple: ':'.join,
+    Namespace: lambda ns: str(ns.join_paths()),
+}
+
+
 class Index:
     def __init__(self, thing_name: str):
         self.mem = OrderedDict()
@@ -136,10 +158,9 @@ def apply_patch(ctx: Namespace, path: str, strip_count: int) -> bool:
     """
     path = os.path.abspath(path)
     name = os.path.basename(path).replace('.patch', '')
-    stamp = '.patched-' + name
+    stamp = _patch_stamp(path)
 
-    if os.path.exists(stamp):
-        # TODO: check modification time
+    if _is_patched(ctx, path):
         return False
 
     ctx.log.debug('applying patch %s' % name)
@@ -152,6 +173,80 @@ def apply_patch(ctx: Namespace, path: str, strip_count: int) -> bool:
     return True
 
 
+def apply_patches(ctx: Namespace, paths: Iterable[str],
+                  strip_count: int) -> List[str]:
+    """
+    Applies a list of patches in the current directory, using the same stamp
+    files as :func:`apply_patch` to skip patches that were applied before.
+
+    All pending patches are applied by a single process. If the current
+    directory is the root of a git repository, this is ``git apply``, which
+    applies either all patches or none of them. Otherwise, the concatenated
+    patches are checked with ``patch --dry-run`` before being applied with a
+    single ``patch`` call. If the batch does not apply (e.g., because two
+    patches touch the same file, which the dry run cannot handle), the
+    patches are applied one by one with :func:`apply_patch`.
+
+    :param ctx: the configuration context
+    :param paths: paths to the patch files, applied in order
+    :param strip_count: number of leading elements to strip from patch paths
+    :returns: paths of the patches that were applied by this call
+    """
+    pending = [os.path.abspath(path) for path in paths]
+    pending = [path for path in pending if not _is_patched(ctx, path)]
+
+    if len(pending) > 1:
+        ctx.log.debug('applying %d patches at once' % len(pending))
+        with tempfile.NamedTemporaryFile('w', suffix='.patch') as batch:
+            for path in pending:
+                with open(path) as f:
+                    contents = f.read()
+                batch.write(contents)
+                if not contents.endswith('\n'):
+                    batch.write('\n')
+            batch.flush()
+
+            if os.path.exists('.git'):
+                proc = run(ctx, ['git', 'apply', '-p%d' % strip_count,
+                                 '--whitespace=nowarn', batch.name],
+                           allow_error=True)
+            else:
+                # patch leaves files half-patched on failure, so check the
+                # entire batch first
+                require_program(ctx, 'patch',
+                                'required to apply source patches')
+                cmd = ['patch', '-p%d' % strip_count, '-i', batch.name]
+                proc = run(ctx, cmd + ['--dry-run'], allow_error=True)
+                if proc and proc.returncode == 0:
+                    run(ctx, cmd)
+
+        if proc and proc.returncode == 0:
+            for path in pending:
+                open(_patch_stamp(path), 'w').close()
+            return pending
+
+        ctx.log.debug('batch does not apply, applying patches one by one')
+
+    return [path for path in pending if apply_patch(ctx, path, strip_count)]
+
+
+def _patch_stamp(path: str) -> str:
+    return '.patched-' + os.path.basename(path).replace('.patch', '')
+
+
+def _is_patched(ctx: Namespace, path: str) -> bool:
+    # a single stat gives both existence and modification time of the stamp
+    try:
+        stamp_mtime = os.stat(_patch_stamp(path)).st_mtime
+    except FileNotFoundError:
+        return False
+
+    if os.path.getmtime(path) > stamp_mtime:
+        ctx.log.warning('patch %s was modified after it was applied, clean '
+                        'the source directory to apply the new version' % path)
+    return True
+
+
 def run(ctx: Namespace, cmd: Union[str, List[str]], allow_error=False,
         silent=False, teeout=False, defer=False,
         env: Dict[str, Union[str, List[str]]] = {}, **kwargs) -> \
@@ -193,18 +288,22 @@ def run(ctx: Namespace, cmd: Union[str, List[str]], allow_error=False,
                    :class:`subprocess.Popen` if ``defer==True``)
     :returns: a handle to the completed or running process
     """
-    cmd = shlex.split(cmd) if isinstance(cmd, str) else [str(c) for c in cmd]
+    cmd = list(_split(cmd)) if isinstance(cmd, str) else [str(c) for c in cmd]
     cmd_print = qjoin(cmd)
     stdin = kwargs.get('stdin', None)
     if isinstance(stdin, io.FileIO):
         cmd_print += ' < ' + shlex.quote(str(stdin.name))
-    ctx.log.debug('running: %s' % cmd_print)
-    ctx.log.debug('workdir: %s' % os.getcwd())
+    ctx.log.debug('running: %s', cmd_print)
+    workdir = os.getcwd()
+    ctx.log.debug('workdir: %s', workdir)
 
     logenv = ctx.runenv.join_paths()
-    logenv.update(Namespace.join_paths(env))
-    renv = os.environ.copy()
-    renv.update(logenv)
+    if env:
+        logenv.update(Namespace.join_paths(env))
+
+    # os.environ is not snapshotted at import time since packages (e.g., Bash)
+    # modify it when setting up the environment
+    renv = {**os.environ, **logenv}
 
     log_output = False
     if defer or silent:
@@ -217,23 +316,26 @@ def run(ctx: Namespace, cmd: Union[str, List[str]], allow_error=False,
         # thread to be able to flush the logfile during long-running commands
         # (use tail -f to view command output)
         if 'runtee' not in ctx:
-            ctx.runtee = _Tee(ctx.runlog, io.StringIO())
+            # keep small outputs in memory, spill large build logs to disk
+            buf = tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+')
+            ctx.runtee = _Tee(ctx.runlog, buf)
 
         strbuf = ctx.runtee.writers[1]
 
         with redirect_stdout(ctx.runlog):
             print('-' * 80)
             print('command: %s' % cmd_print)
-            print('workdir: %s' % os.getcwd())
+            print('workdir: %s' % workdir)
             for k, v in logenv.items():
                 print('%s=%s' % (k, v))
             hdr = '-- output: '
             print(hdr + '-' * (80 - len(hdr)))
 
         if teeout:
-            kwargs['stdout'] = _Tee(ctx.runtee, sys.stdout)
+            tee = _Tee(ctx.runtee, sys.stdout)
         else:
-            kwargs['stdout'] = ctx.runtee
+            tee = ctx.runtee
+        kwargs['stdout'] = tee
 
         kwargs.setdefault('stderr', subprocess.STDOUT)
 
@@ -252,16 +354,24 @@ def run(ctx: Namespace, cmd: Union[str, List[str]], allow_error=False,
     except FileNotFoundError:
         logfn = ctx.log.debug if allow_error else ctx.log.error
         logfn('command not found: %s' % cmd_print)
-        logfn('workdir:           %s' % os.getcwd())
+        logfn('workdir:           %s' % workdir)
         if allow_error:
             return
         raise
 
     if log_output:
-        proc.stdout = strbuf.getvalue()
+        # the flusher thread may still be processing the tail of the output
+        if tee is ctx.runtee:
+            tee.sync()
+        else:
+            tee.close()
+        strbuf.seek(0)
+        proc.stdout = strbuf.read()
 
-        # delete dangling buffer to free up memory
-        ctx.runtee.writers[1] = io.StringIO()
+        # empty the buffer for the next command to free up memory (or disk
+        # space), the same buffer is reused across commands
+        strbuf.seek(0)
+        strbuf.truncate()
 
         # add trailing newline to logfile for readability
         ctx.runlog.write('\n')
@@ -270,7 +380,7 @@ def run(ctx: Namespace, cmd: Union[str, List[str]], allow_error=False,
     if proc.returncode and not allow_error:
         ctx.log.error('command returned status %d' % proc.returncode)
         ctx.log.error('command: %s' % cmd_print)
-        ctx.log.error('workdir: %s' % os.getcwd())
+        ctx.log.error('workdir: %s' % workdir)
         for k, v in logenv.items():
             ctx.log.error('%s=%s' % (k, v))
         if proc.stdout is not None:
@@ -289,13 +399,102 @@ def qjoin(args: Iterable[Any]) -> str:
 
     :param args: arguments to join
     """
-    return ' '.join(shlex.quote(str(arg)) for arg in args)
+    quoted = []
+    for arg in args:
+        arg = str(arg)
+        quoted.append(arg if _is_shell_safe(arg) else shlex.quote(arg))
+    return ' '.join(quoted)
+
+
+_is_shell_safe = re.compile(r'[\w@%+=:,./-]+', re.ASCII).fullmatch
+
+
+@functools.lru_cache(maxsize=1024)
+def _split(cmd: str) -> tuple:
+    # build recipes tend to run the same command strings over and over
+    return tuple(shlex.split(cmd))
+
+
+def make_parallel_args(ctx: Namespace) -> List[str]:
+    """
+    Get the ``make`` arguments for a parallel build with ``ctx.jobs`` jobs.
+    Besides ``-j``, this passes a load limit (``-l``) so that ``make`` stops
+    spawning new jobs when the system is already busy, e.g., when the build
+    itself invokes other parallel builds.
+
+    :param ctx: the configuration context
+    :returns: ``['-j<ctx.jobs>', '-l<ctx.jobs>']``
+    """
+    return ['-j%d' % ctx.jobs, '-l%d' % ctx.jobs]
+
+
+def find_compiler(ctx: Optional[Namespace] = None, var: str = 'CC',
+                  default: str = 'gcc') -> Optional[str]:
+    """
+    Find the compiler that builds use for an environment variable: the
+    compiler named in ``$<var>`` (or **default** if it is not set), skipping
+    a ``ccache`` prefix. This is also the compiler wrapped by
+    :func:`CCache.compiler_vars <infra.packages.CCache.compiler_vars>`.
+
+    :param ctx: the configuration context, if given the compiler is looked up
+                in ``ctx.runenv.PATH`` instead of the ``PATH`` of this process
+    :param var: environment variable naming the compiler, e.g., ``CXX``
+    :param default: compiler to use if **var** is not set
+    :returns: absolute path to the compiler, or ``None`` if it is not found
+    """
+    words = [w for w in os.getenv(var, default).split()
+             if os.path.basename(w) != 'ccache']
+    if not words:
+        return None
+    if ctx is not None and 'PATH' in ctx.runenv:
+        path = Namespace(PATH=ctx.runenv.PATH).join_paths().PATH
+    else:
+        path = os.getenv('PATH')
+    return shutil.which(words[0], path=path)
+
+
+def autoconf_cache_file(ctx: Namespace, name: str,
+                        configure_args: Iterable[Any]) -> str:
+    """
+    Get a path to pass to ``configure --cache-file=<path>``, so that autoconf
+    checks are not re-run when a package is reconfigured. The cache is stored
+    in ``ctx.paths.cache/autoconf``. Its name contains a hash of
+    **configure_args**, ``ctx.runenv`` and the compiler variables from the
+    environment, so that a toolchain change results in a fresh cache.
+
+    :param ctx: the configuration context
+    :param name: cache name prefix, typically the package identifier
+    :param configure_args: arguments passed to ``configure``
+    :returns: absolute path to the cache file
+    """
+    compiler_vars = ('CC', 'CFLAGS', 'CPP', 'CPPFLAGS', 'CXX', 'CXXFLAGS',
+                     'LDFLAGS', 'LIBS')
+    key = [list(map(str, configure_args)),
+           sorted(ctx.runenv.join_paths().items()),
+           [os.getenv(var) for var in compiler_vars]]
+
+    # the compiler binary may be upgraded in place
+    cc = find_compiler(ctx)
+    if cc:
+        key.append(os.stat(cc).st_mtime_ns)
+
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+    cachedir = os.path.join(ctx.paths.cache, 'autoconf')
+    os.makedirs(cachedir, exist_ok=True)
+    return os.path.join(cachedir, '%s-%s.cache' % (name, digest))
 
 
 def download(ctx: Namespace, url: str, outfile: Optional[str] = None):
     """
     Download a file (logs to the debug log).
 
+    If the `requests <https://requests.readthedocs.io>`_ module is installed,
+    HTTP(S) downloads use a shared session that keeps connections alive, so
+    subsequent downloads from the same host skip the TCP/TLS handshake.
+
+    If **outfile** already exists, it is only downloaded again if the server
+    reports that the file was modified since (using ``If-Modified-Since``).
+
     :param ctx: the configuration context
     :param url: URL to the file to download
     :param outfile: optional path/filename to download to
@@ -305,7 +504,182 @@ def download(ctx: Namespace, url: str, outfile: Optional[str] = None):
     else:
         outfile = os.path.basename(urlparse(url).path)
         ctx.log.debug('downloading %s' % url)
-    urlretrieve(url, outfile)
+    if not _download_file(url, outfile):
+        ctx.log.debug('%s is up to date' % outfile)
+
+
+def download_many(ctx: Namespace, urls: Iterable[str], outdir: str = '.',
+                  workers: int = 8, per_host: int = 4) -> List[str]:
+    """
+    Download multiple files concurrently using a thread pool (logs to the
+    debug log). Like :func:`download`, files are named after the last URL path
+    component. The number of simultaneous downloads from the same host is
+    limited by **per_host** to avoid server-side throttling.
+
+    :param ctx: the configuration context
+    :param urls: URLs of the files to download
+    :param outdir: directory to download to, created if it does not exist
+    :param workers: maximum total number of simultaneous downloads
+    :param per_host: maximum number of simultaneous downloads per host
+    :returns: paths to the downloaded files, in the same order as **urls**
+    """
+    urls = list(urls)
+    outfiles = [os.path.join(outdir, os.path.basename(urlparse(url).path))
+                for url in urls]
+    host_slots = {urlparse(url).netloc: threading.BoundedSemaphore(per_host)
+                  for url in urls}
+    os.makedirs(outdir, exist_ok=True)
+
+    def fetch(url, outfile):
+        with host_slots[urlparse(url).netloc]:
+            ctx.log.debug('downloading %s to %s' % (url, outfile))
+            if not _download_file(url, outfile):
+                ctx.log.debug('%s is up to date' % outfile)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, url, outfile): url
+                   for url, outfile in zip(urls, outfiles)}
+        for future in as_completed(futures):
+            future.result()
+            ctx.log.debug('finished downloading %s' % futures[future])
+
+    return outfiles
+
+
+# None: not created yet, False: requests is not installed
+_http_session = None
+
+
+def _get_http_session():
+    global _http_session
+    if _http_session is None:
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+        except ImportError:
+            _http_session = False
+        else:
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64,
+                                  max_retries=Retry(total=3, backoff_factor=0.5))
+            _http_session = requests.Session()
+            _http_session.mount('http://', adapter)
+            _http_session.mount('https://', adapter)
+    return _http_session or None
+
+
+def _fetch_url(url: str, outfile: BinaryIO,
+               headers: Optional[Dict[str, str]] = None
+               ) -> Optional[Mapping[str, str]]:
+    # returns the response headers, or None if the server responded with 304
+    # (Not Modified) and nothing was written
+    headers = headers or {}
+    session = _get_http_session()
+    if session is None or urlparse(url).scheme not in ('http', 'https'):
+        try:
+            response = urlopen(Request(url, headers=headers))
+        except HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        with response:
+            # use the same chunk size as with the session below, the default
+            # of 64KiB makes large tarballs spend a lot of time in the copy loop
+            shutil.copyfileobj(response, outfile, 1 << 20)
+            return response.headers
+
+    with session.get(url, headers=headers, stream=True,
+                     timeout=(5, 60)) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        # store the raw bytes: servers may send tarballs with a gzip
+        # Content-Encoding, which iter_content() would decompress
+        response.raw.decode_content = False
+        shutil.copyfileobj(response.raw, outfile, 1 << 20)
+        return response.headers
+
+
+def _download_file(url: str, outfile: str) -> bool:
+    headers = {}
+    if os.path.exists(outfile):
+        mtime = os.path.getmtime(outfile)
+        headers['If-Modified-Since'] = formatdate(mtime, usegmt=True)
+
+    # download to a temporary file to keep the existing file intact if the
+    # server responds with 304 or the transfer fails
+    partfile = outfile + '.part'
+    try:
+        with open(partfile, 'wb') as f:
+            response_headers = _fetch_url(url, f, headers)
+        if response_headers is None:
+            return False
+        os.replace(partfile, outfile)
+    finally:
+        if os.path.exists(partfile):
+            os.remove(partfile)
+
+    # use the server's modification time for the next If-Modified-Since, so
+    # that clock skew does not matter
+    last_modified = response_headers.get('Last-Modified')
+    if last_modified:
+        try:
+            mtime = parsedate_to_datetime(last_modified).timestamp()
+        except (TypeError, ValueError):
+            pass
+        else:
+            os.utime(outfile, (mtime, mtime))
+    return True
+
+
+def git_clone(ctx: Namespace, url: str, dest: str,
+              commit: Optional[str] = None):
+    """
+    Clone a git repository using a local bare mirror as reference (logs to the
+    debug log).
+
+    The mirror is stored in ``ctx.paths.cache/git-mirrors``. It is created on
+    first use and updated on subsequent calls, so that only new objects are
+    fetched from the remote. The clone is dissociated from the mirror, so
+    removing the cache does not break existing clones. Mirror updates are
+    serialized with a file lock to allow concurrent setup invocations.
+
+    If **commit** is given, the default branch is never checked out: the
+    working tree is only populated once, for the requested commit.
+
+    :param ctx: the configuration context
+    :param url: URL of the remote repository
+    :param dest: path to clone to
+    :param commit: optional branch/tag/commit to check out after cloning
+    """
+    require_program(ctx, 'git', 'required to clone source repositories')
+
+    parsed = urlparse(url)
+    mirror = os.path.join(ctx.paths.cache, 'git-mirrors', parsed.netloc,
+                          parsed.path.strip('/'))
+    if not mirror.endswith('.git'):
+        mirror += '.git'
+    os.makedirs(os.path.dirname(mirror), exist_ok=True)
+
+    with open(mirror + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.exists(mirror):
+            ctx.log.debug('updating git mirror %s' % mirror)
+            run(ctx, ['git', '-C', mirror, 'remote', 'update', '--prune'])
+        else:
+            ctx.log.debug('creating git mirror %s' % mirror)
+            run(ctx, ['git', 'clone', '--mirror', url, mirror])
+
+        # keep the lock while cloning to avoid pruning objects underneath us
+        ctx.log.debug('cloning %s to %s' % (url, dest))
+        checkout = [] if commit is None else ['--no-checkout']
+        run(ctx, ['git', 'clone', '--reference', mirror, '--dissociate',
+                  *checkout, url, dest])
+
+    if commit is not None:
+        run(ctx, ['git', '-C', dest, 'checkout', commit])
 
 
 class _Tee(io.IOBase):
@@ -313,42 +687,117 @@ class _Tee(io.IOBase):
         super().__init__()
         assert len(writers) > 0
         self.writers = list(writers)
-        self.readfd, self.writefd = os.pipe()
+        self.binary = all('b' in getattr(w, 'mode', '') for w in writers)
+        self.readfd = self.writefd = None
         self.running = False
+
+    def _start_flusher(self):
+        self.readfd, self.writefd = os.pipe()
+        self.wakeup_readfd, self.wakeup_writefd = os.pipe()
+        os.set_blocking(self.readfd, False)
+        self.synced = threading.Event()
+        self.error = None
+        self.running = True
         self.thread = threading.Thread(target=self._flusher)
         self.thread.daemon = True
         self.thread.start()
 
     def _flusher(self):
-        self.running = True
-        poller = select.poll()
-        poller.register(self.readfd, select.POLLIN | select.POLLPRI)
-        buf = b''
-        while self.running:
-            for fd, flag in poller.poll():
-                assert fd == self.readfd
-                if flag & (select.POLLIN | select.POLLPRI):
-                    buf += os.read(fd, io.DEFAULT_BUFFER_SIZE)
-                    nl = buf.find(b'\n') + 1
-                    while nl > 0:
-                        self.write(buf[:nl].decode(errors='replace'))
-                        self.flush()
-                        buf = buf[nl:]
-                        nl = buf.find(b'\n') + 1
+        try:
+            self._flush_pipe()
+        except BaseException as e:
+            # reported by sync()
+            self.error = e
+            raise
+
+    def _flush_pipe(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.readfd, selectors.EVENT_READ)
+        sel.register(self.wakeup_readfd, selectors.EVENT_READ)
+        buf = bytearray()
+        while True:
+            for key, events in sel.select():
+                eof = self._drain(buf)
+
+                # write all complete lines at once and keep the remainder
+                # around, instead of slicing off one line at a time, unless
+                # sync() asks for everything or there is no more output
+                if key.fd == self.wakeup_readfd:
+                    os.read(self.wakeup_readfd, 64)
+                if key.fd == self.wakeup_readfd or eof:
+                    end = len(buf)
+                else:
+                    end = buf.rfind(b'\n') + 1
+
+                if end > 0:
+                    data = buf[:end]
+                    self.write(data if self.binary else
+                               data.decode(errors='replace'))
+                    self.flush()
+                    del buf[:end]
+
+                if key.fd == self.wakeup_readfd:
+                    self.synced.set()
+
+                if eof:
+                    # write end closed, see close()
+                    sel.close()
+                    return
+
+    def _drain(self, buf: bytearray) -> bool:
+        while True:
+            try:
+                data = os.read(self.readfd, 1 << 16)
+            except BlockingIOError:
+                return False
+            if not data:
+                return True
+            buf += data
+
+    def sync(self):
+        """
+        Wait until everything written to :func:`fileno` so far has been passed
+        on to the writers.
+        """
+        if not self.running:
+            return
+
+        self.synced.clear()
+        if self.thread.is_alive():
+            os.write(self.wakeup_writefd, b'\0')
+            while not self.synced.wait(0.1):
+                if not self.thread.is_alive():
+                    break
+        if self.synced.is_set():
+            return
+
+        # the flusher thread died (e.g., a writer raised ENOSPC), drop the pipe
+        # so that the next fileno() call starts a fresh one instead of letting
+        # commands block on a pipe that nobody reads
+        self.running = False
+        for fd in (self.writefd, self.readfd,
+                   self.wakeup_writefd, self.wakeup_readfd):
+            os.close(fd)
+        self.readfd = self.writefd = None
+        raise FatalError('could not write command output: %s' % self.error)
 
     def flush(self):
         for w in self.writers:
             w.flush()
 
     def write(self, data):
-        len1 = self.writers[0].write(data)
+        n = self.writers[0].write(data)
         for w in self.writers[1:]:
-            len2 = w.write(data)
-            assert len2 == len1
-        return len1
+            w.write(data)
+        return n
     emit = write
 
     def fileno(self):
+        # subprocess needs a real file descriptor to write to, so create the
+        # pipe and its flusher thread on demand; python-level writes (and
+        # tees that are only written to by other tees) never pay for them
+        if self.writefd is None:
+            self._start_flusher()
         return self.writefd
 
     def __del__(self):
@@ -356,10 +805,18 @@ class _Tee(io.IOBase):
 
     def close(self):
         if self.running:
+            # closing the write end wakes up the flusher thread, which writes
+            # out any remaining output when it reads EOF and then exits
             self.running = False
-            self.thread.join(0)
-            os.close(self.readfd)
             os.close(self.writefd)
+            self.thread.join(1.0)
+
+            # leak the other fds rather than pulling them away from under a
+            # thread that is stuck writing
+            if not self.thread.is_alive():
+                os.close(self.readfd)
+                os.close(self.wakeup_writefd)
+                os.close(self.wakeup_readfd)
 
 
 def param_attrs(constructor: Callable) -> Callable:
@@ -437,3 +894,60 @@ def untar(ctx: Namespace, tarname: str, dest: Optional[str] = None, *,
         shutil.move(basename, dest)
     if remove:
         os.remove(tarname)
+
+
+def download_untar(ctx: Namespace, url: str, dest: str):
+    """
+    Download a tarball and unpack it into **dest** while downloading, without
+    storing the archive on disk (logs to the debug log). The top-level
+    directory of the archive is stripped, so **dest** directly contains its
+    contents. The compression type is derived from the file extension.
+
+    The archive is unpacked into a temporary ``<dest>.part`` directory which
+    is renamed to **dest** only after ``tar`` succeeds, so a failed or
+    interrupted download never leaves a partial **dest** behind.
+
+    :param ctx: the configuration context
+    :param url: URL to the tarball to download
+    :param dest: directory to unpack to, must not exist or be empty
+    :raises FatalError: if the archive could not be unpacked
+    """
+    require_program(ctx, 'tar', 'required to unpack source tarfile')
+    ext = os.path.splitext(urlparse(url).path)[1]
+    compression = {'.gz': 'z', '.tgz': 'z', '.bz2': 'j', '.xz': 'J'}.get(ext, '')
+
+    ctx.log.debug('downloading %s to %s' % (url, dest))
+    partdir = dest.rstrip('/') + '.part'
+    shutil.rmtree(partdir, ignore_errors=True)
+    os.makedirs(partdir)
+
+    try:
+        # tar output goes to a file rather than a pipe, which would block tar
+        # (and thus the download) if it fills up before tar exits
+        with tempfile.TemporaryFile() as errfile:
+            proc = run(ctx, ['tar', '-x' + compression, '--strip-components=1',
+                             '-C', partdir], defer=True, stdin=subprocess.PIPE,
+                       stdout=subprocess.DEVNULL, stderr=errfile,
+                       universal_newlines=False)
+            try:
+                _fetch_url(url, proc.stdin)
+            except BrokenPipeError:
+                # tar exited early, error is reported below
+                pass
+            finally:
+                # let tar see EOF and reap it, also if the download failed
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+                proc.wait()
+
+            if proc.returncode:
+                errfile.seek(0)
+                ctx.log.error(errfile.read().decode(errors='replace').strip())
+                raise FatalError('could not unpack %s' % url)
+    except BaseException:
+        shutil.rmtree(partdir, ignore_errors=True)
+        raise
+
+    os.rename(partdir, dest)